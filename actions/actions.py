@@ -11,6 +11,129 @@ import random
 import json
 from datetime import datetime, timedelta
 
+from .idempotency import idempotent
+from .resilience import BackendUnavailable, Deadline, ResilientBackend, format_as_of, start_metrics_server
+
+
+# Backend services called by the actions. Each one gets its own timeout and
+# circuit breaker so a single slow dependency cannot stall every conversation.
+ACCOUNTS_BACKEND = ResilientBackend("accounts", timeout=2.0)
+BRANCHES_BACKEND = ResilientBackend("branches", timeout=1.5)
+
+start_metrics_server()
+
+
+def fetch_balance(account_type: Text) -> Text:
+    """Accounts service balance lookup (mocked data; in real system, this would query a database)"""
+    mock_balances = {
+        "checking": "$5,432.10",
+        "savings": "$12,345.67",
+        "default": "$5,432.10"
+    }
+    return mock_balances.get(account_type.lower(), mock_balances["default"])
+
+
+def fetch_transactions() -> List[Dict[Text, Text]]:
+    """Accounts service transaction history (mocked data)"""
+    today = datetime.now()
+    return [
+        {"date": (today - timedelta(days=1)).strftime("%Y-%m-%d"),
+         "description": "DEBIT CARD PURCHASE - COFFEE SHOP",
+         "amount": "-$4.50"},
+        {"date": (today - timedelta(days=1)).strftime("%Y-%m-%d"),
+         "description": "DIRECT DEPOSIT - SALARY",
+         "amount": "+$3,500.00"},
+        {"date": (today - timedelta(days=2)).strftime("%Y-%m-%d"),
+         "description": "ONLINE BILL PAY - UTILITIES",
+         "amount": "-$125.00"},
+        {"date": (today - timedelta(days=3)).strftime("%Y-%m-%d"),
+         "description": "ATM WITHDRAWAL",
+         "amount": "-$100.00"},
+        {"date": (today - timedelta(days=4)).strftime("%Y-%m-%d"),
+         "description": "TRANSFER FROM SAVINGS",
+         "amount": "+$500.00"},
+    ]
+
+
+def fetch_branch(location: Any) -> Dict[Text, Text]:
+    """Branch service lookup (mocked data)"""
+    mock_branches = {
+        "new york": {
+            "name": "Main Street Branch",
+            "address": "123 Main Street, New York, NY 10001",
+            "phone": "(212) 555-0100",
+            "hours": "Mon-Fri: 9:00 AM - 5:00 PM, Sat: 9:00 AM - 2:00 PM"
+        },
+        "downtown": {
+            "name": "Downtown Branch",
+            "address": "456 Market Street, New York, NY 10002",
+            "phone": "(212) 555-0200",
+            "hours": "Mon-Fri: 8:30 AM - 6:00 PM, Sat: 10:00 AM - 3:00 PM"
+        },
+        "default": {
+            "name": "Central Branch",
+            "address": "789 Bank Avenue, New York, NY 10003",
+            "phone": "(212) 555-0300",
+            "hours": "Mon-Fri: 9:00 AM - 5:00 PM, Sat: 9:00 AM - 2:00 PM"
+        }
+    }
+
+    if location and str(location).lower() in mock_branches:
+        return mock_branches[str(location).lower()]
+    return mock_branches["default"]
+
+
+async def _balance_message(tracker: Tracker, deadline: Deadline) -> Text:
+    """Balance sentence for the current account type, falling back to a cached balance"""
+    account_type = tracker.get_slot("account_type") or "checking"
+    try:
+        balance = await ACCOUNTS_BACKEND.call(
+            fetch_balance, account_type,
+            deadline=deadline,
+            cache_key=("balance", tracker.sender_id, account_type.lower()),
+        )
+    except BackendUnavailable as e:
+        if e.cached is None:
+            return (
+                "I'm unable to retrieve your account balance right now. "
+                "Please try again in a few minutes or check our mobile app."
+            )
+        return (
+            "I can't reach our account system right now. "
+            f"Your {account_type} account balance was {e.cached.value} as of {format_as_of(e.cached)}."
+        )
+    return f"Your {account_type} account balance is {balance}."
+
+
+async def _transactions_message(tracker: Tracker, deadline: Deadline) -> Text:
+    """Recent transactions listing, falling back to a cached listing"""
+    as_of = None
+    try:
+        transactions = await ACCOUNTS_BACKEND.call(
+            fetch_transactions,
+            deadline=deadline,
+            cache_key=("transactions", tracker.sender_id),
+        )
+    except BackendUnavailable as e:
+        if e.cached is None:
+            return (
+                "I'm unable to retrieve your recent transactions right now. "
+                "Please try again in a few minutes or check our mobile app."
+            )
+        transactions, as_of = e.cached.value, format_as_of(e.cached)
+
+    transactions_text = "\n".join([
+        f"{tx['date']}: {tx['description']} {tx['amount']}"
+        for tx in transactions
+    ])
+
+    if as_of:
+        return (
+            "I can't reach our account system right now. "
+            f"Here are your recent transactions as of {as_of}:\n\n{transactions_text}"
+        )
+    return f"Here are your recent transactions:\n\n{transactions_text}"
+
 
 class ActionCheckBalance(Action):
     """Action to check account balance (mocked data)"""
@@ -18,7 +141,8 @@ class ActionCheckBalance(Action):
     def name(self) -> Text:
         return "action_check_balance"
 
-    def run(
+    @idempotent
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -35,20 +159,10 @@ class ActionCheckBalance(Action):
             return [SlotSet("requested_action", "check_balance")]
         
         # If we get here, identity is verified - show balance
-        # Get account type from slot or default to checking
-        account_type = tracker.get_slot("account_type") or "checking"
-        
-        # Mock balance data (in real system, this would query a database)
-        mock_balances = {
-            "checking": "$5,432.10",
-            "savings": "$12,345.67",
-            "default": "$5,432.10"
-        }
-        
-        balance = mock_balances.get(account_type.lower(), mock_balances["default"])
-        
+        deadline = Deadline()
+        balance_text = await _balance_message(tracker, deadline)
         dispatcher.utter_message(
-            text=f"Your {account_type} account balance is {balance}. Is there anything else I can help with?"
+            text=f"{balance_text} Is there anything else I can help with?"
         )
         
         return []
@@ -60,7 +174,8 @@ class ActionViewTransactions(Action):
     def name(self) -> Text:
         return "action_view_transactions"
 
-    def run(
+    @idempotent
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -77,34 +192,10 @@ class ActionViewTransactions(Action):
             return [SlotSet("requested_action", "view_transactions")]
         
         # If we get here, identity is verified - show transactions
-
-        # Mock transaction data
-        today = datetime.now()
-        mock_transactions = [
-            {"date": (today - timedelta(days=1)).strftime("%Y-%m-%d"), 
-             "description": "DEBIT CARD PURCHASE - COFFEE SHOP", 
-             "amount": "-$4.50"},
-            {"date": (today - timedelta(days=1)).strftime("%Y-%m-%d"), 
-             "description": "DIRECT DEPOSIT - SALARY", 
-             "amount": "+$3,500.00"},
-            {"date": (today - timedelta(days=2)).strftime("%Y-%m-%d"), 
-             "description": "ONLINE BILL PAY - UTILITIES", 
-             "amount": "-$125.00"},
-            {"date": (today - timedelta(days=3)).strftime("%Y-%m-%d"), 
-             "description": "ATM WITHDRAWAL", 
-             "amount": "-$100.00"},
-            {"date": (today - timedelta(days=4)).strftime("%Y-%m-%d"), 
-             "description": "TRANSFER FROM SAVINGS", 
-             "amount": "+$500.00"},
-        ]
-        
-        transactions_text = "\n".join([
-            f"{tx['date']}: {tx['description']} {tx['amount']}"
-            for tx in mock_transactions
-        ])
-        
+        deadline = Deadline()
+        transactions_text = await _transactions_message(tracker, deadline)
         dispatcher.utter_message(
-            text=f"Here are your recent transactions:\n\n{transactions_text}\n\nIs there anything else you need?"
+            text=f"{transactions_text}\n\nIs there anything else you need?"
         )
         
         return []
@@ -116,7 +207,8 @@ class ActionBranchLocator(Action):
     def name(self) -> Text:
         return "action_branch_locator"
 
-    def run(
+    @idempotent
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -134,32 +226,22 @@ class ActionBranchLocator(Action):
         if not location:
             location = tracker.get_slot("branch_location")
         
-        # Mock branch data
-        mock_branches = {
-            "new york": {
-                "name": "Main Street Branch",
-                "address": "123 Main Street, New York, NY 10001",
-                "phone": "(212) 555-0100",
-                "hours": "Mon-Fri: 9:00 AM - 5:00 PM, Sat: 9:00 AM - 2:00 PM"
-            },
-            "downtown": {
-                "name": "Downtown Branch",
-                "address": "456 Market Street, New York, NY 10002",
-                "phone": "(212) 555-0200",
-                "hours": "Mon-Fri: 8:30 AM - 6:00 PM, Sat: 10:00 AM - 3:00 PM"
-            },
-            "default": {
-                "name": "Central Branch",
-                "address": "789 Bank Avenue, New York, NY 10003",
-                "phone": "(212) 555-0300",
-                "hours": "Mon-Fri: 9:00 AM - 5:00 PM, Sat: 9:00 AM - 2:00 PM"
-            }
-        }
-        
-        if location and str(location).lower() in mock_branches:
-            branch = mock_branches[str(location).lower()]
-        else:
-            branch = mock_branches["default"]
+        deadline = Deadline()
+        try:
+            branch = await BRANCHES_BACKEND.call(
+                fetch_branch, location,
+                deadline=deadline,
+                cache_key=("branch", str(location).lower() if location else None),
+            )
+        except BackendUnavailable as e:
+            if e.cached is None:
+                dispatcher.utter_message(
+                    text="I'm unable to look up branch locations right now. "
+                    "You can find your nearest branch on our website or mobile app, "
+                    "or call our 24/7 hotline at 1-800-BANK-HELP."
+                )
+                return []
+            branch = e.cached.value
         
         branch_details = (
             f"{branch['name']}\n"
@@ -181,12 +263,15 @@ class ActionVerifyIdentity(Action):
     def name(self) -> Text:
         return "action_verify_identity"
 
-    def run(
+    @idempotent
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
         domain: DomainDict,
     ) -> List[Dict[Text, Any]]:
+        deadline = Deadline()
+        
         # Get account number from entities or latest message
         account_number = None
         
@@ -215,15 +300,9 @@ class ActionVerifyIdentity(Action):
             
             # If there was a pending action (balance or transactions), complete it automatically
             if requested_action == "check_balance":
-                account_type = tracker.get_slot("account_type") or "checking"
-                mock_balances = {
-                    "checking": "$5,432.10",
-                    "savings": "$12,345.67",
-                    "default": "$5,432.10"
-                }
-                balance = mock_balances.get(account_type.lower(), mock_balances["default"])
+                balance_text = await _balance_message(tracker, deadline)
                 dispatcher.utter_message(
-                    text=f"Identity verified. Your {account_type} account balance is {balance}. Is there anything else I can help with?"
+                    text=f"Identity verified. {balance_text} Is there anything else I can help with?"
                 )
                 return [
                     SlotSet("identity_verified", True), 
@@ -231,31 +310,9 @@ class ActionVerifyIdentity(Action):
                     SlotSet("requested_action", None)
                 ]
             elif requested_action == "view_transactions":
-                from datetime import datetime, timedelta
-                today = datetime.now()
-                mock_transactions = [
-                    {"date": (today - timedelta(days=1)).strftime("%Y-%m-%d"), 
-                     "description": "DEBIT CARD PURCHASE - COFFEE SHOP", 
-                     "amount": "-$4.50"},
-                    {"date": (today - timedelta(days=1)).strftime("%Y-%m-%d"), 
-                     "description": "DIRECT DEPOSIT - SALARY", 
-                     "amount": "+$3,500.00"},
-                    {"date": (today - timedelta(days=2)).strftime("%Y-%m-%d"), 
-                     "description": "ONLINE BILL PAY - UTILITIES", 
-                     "amount": "-$125.00"},
-                    {"date": (today - timedelta(days=3)).strftime("%Y-%m-%d"), 
-                     "description": "ATM WITHDRAWAL", 
-                     "amount": "-$100.00"},
-                    {"date": (today - timedelta(days=4)).strftime("%Y-%m-%d"), 
-                     "description": "TRANSFER FROM SAVINGS", 
-                     "amount": "+$500.00"},
-                ]
-                transactions_text = "\n".join([
-                    f"{tx['date']}: {tx['description']} {tx['amount']}"
-                    for tx in mock_transactions
-                ])
+                transactions_text = await _transactions_message(tracker, deadline)
                 dispatcher.utter_message(
-                    text=f"Identity verified. Here are your recent transactions:\n\n{transactions_text}\n\nIs there anything else you need?"
+                    text=f"Identity verified. {transactions_text}\n\nIs there anything else you need?"
                 )
                 return [
                     SlotSet("identity_verified", True), 
@@ -297,6 +354,7 @@ class ActionSetIdentityVerified(Action):
     def name(self) -> Text:
         return "action_set_identity_verified"
 
+    @idempotent
     def run(
         self,
         dispatcher: CollectingDispatcher,
@@ -312,7 +370,8 @@ class ActionLostCardFlow(Action):
     def name(self) -> Text:
         return "action_lost_card_flow"
 
-    def run(
+    @idempotent
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -320,6 +379,7 @@ class ActionLostCardFlow(Action):
     ) -> List[Dict[Text, Any]]:
         # Check if there's a pending verification request and user provided a number
         # If so, handle verification instead of lost card
+        deadline = Deadline()
         requested_action = tracker.get_slot("requested_action")
         text = tracker.latest_message.get("text", "").strip()
         
@@ -330,15 +390,9 @@ class ActionLostCardFlow(Action):
             account_number = text
             # Set identity as verified and complete the requested action
             if requested_action == "check_balance":
-                account_type = tracker.get_slot("account_type") or "checking"
-                mock_balances = {
-                    "checking": "$5,432.10",
-                    "savings": "$12,345.67",
-                    "default": "$5,432.10"
-                }
-                balance = mock_balances.get(account_type.lower(), mock_balances["default"])
+                balance_text = await _balance_message(tracker, deadline)
                 dispatcher.utter_message(
-                    text=f"Identity verified. Your {account_type} account balance is {balance}. Is there anything else I can help with?"
+                    text=f"Identity verified. {balance_text} Is there anything else I can help with?"
                 )
                 return [
                     SlotSet("identity_verified", True), 
@@ -346,31 +400,9 @@ class ActionLostCardFlow(Action):
                     SlotSet("requested_action", None)
                 ]
             elif requested_action == "view_transactions":
-                from datetime import datetime, timedelta
-                today = datetime.now()
-                mock_transactions = [
-                    {"date": (today - timedelta(days=1)).strftime("%Y-%m-%d"), 
-                     "description": "DEBIT CARD PURCHASE - COFFEE SHOP", 
-                     "amount": "-$4.50"},
-                    {"date": (today - timedelta(days=1)).strftime("%Y-%m-%d"), 
-                     "description": "DIRECT DEPOSIT - SALARY", 
-                     "amount": "+$3,500.00"},
-                    {"date": (today - timedelta(days=2)).strftime("%Y-%m-%d"), 
-                     "description": "ONLINE BILL PAY - UTILITIES", 
-                     "amount": "-$125.00"},
-                    {"date": (today - timedelta(days=3)).strftime("%Y-%m-%d"), 
-                     "description": "ATM WITHDRAWAL", 
-                     "amount": "-$100.00"},
-                    {"date": (today - timedelta(days=4)).strftime("%Y-%m-%d"), 
-                     "description": "TRANSFER FROM SAVINGS", 
-                     "amount": "+$500.00"},
-                ]
-                transactions_text = "\n".join([
-                    f"{tx['date']}: {tx['description']} {tx['amount']}"
-                    for tx in mock_transactions
-                ])
+                transactions_text = await _transactions_message(tracker, deadline)
                 dispatcher.utter_message(
-                    text=f"Identity verified. Here are your recent transactions:\n\n{transactions_text}\n\nIs there anything else you need?"
+                    text=f"Identity verified. {transactions_text}\n\nIs there anything else you need?"
                 )
                 return [
                     SlotSet("identity_verified", True), 
@@ -417,6 +449,7 @@ class ActionGeneralFAQ(Action):
     def name(self) -> Text:
         return "action_general_faq"
 
+    @idempotent
     def run(
         self,
         dispatcher: CollectingDispatcher,
@@ -482,6 +515,7 @@ class ActionFallbackHandler(Action):
     def name(self) -> Text:
         return "action_fallback_handler"
 
+    @idempotent
     def run(
         self,
         dispatcher: CollectingDispatcher,
@@ -0,0 +1,292 @@
+"""
+Idempotent action execution: caches action results so that a webhook call
+retried by the Rasa server returns the same events and messages instead of
+running the action again
+"""
+
+import asyncio
+import copy
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Text, Tuple
+
+from rasa_sdk import Tracker
+from rasa_sdk.executor import CollectingDispatcher
+from rasa_sdk.types import DomainDict
+
+
+# How long a computed result is reused, and how many results are kept
+DEFAULT_CACHE_TTL = float(os.environ.get("ACTION_RESULT_CACHE_TTL_SECONDS", "300"))
+DEFAULT_CACHE_SIZE = int(os.environ.get("ACTION_RESULT_CACHE_SIZE", "4096"))
+
+# Upper bound on how long a retry waits for the original call still in progress
+IN_FLIGHT_WAIT = float(os.environ.get("ACTION_RESULT_IN_FLIGHT_WAIT_SECONDS", "10"))
+
+
+class ActionResult:
+    """Events returned and messages sent by one action run"""
+
+    def __init__(self, events: List[Dict[Text, Any]], messages: List[Dict[Text, Any]], stored_at: float):
+        self.events = events
+        self.messages = messages
+        self.stored_at = stored_at
+
+
+class _InFlight:
+    """Marker for a key whose action is running; wakes both thread and coroutine waiters"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.waiters: List[Tuple[asyncio.AbstractEventLoop, "asyncio.Future[None]"]] = []
+
+    def set(self) -> None:
+        self.event.set()
+        for loop, waiter in self.waiters:
+            loop.call_soon_threadsafe(_resolve, waiter)
+
+
+def _resolve(waiter: "asyncio.Future[None]") -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class ActionResultCache:
+    """
+    Bounded, time-expiring cache of action results, safe to share between
+    concurrent requests. A request for a key that is still being computed
+    waits for that result instead of running the action a second time.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_CACHE_SIZE,
+        ttl: float = DEFAULT_CACHE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, ActionResult]" = OrderedDict()
+        self._in_flight: Dict[Hashable, _InFlight] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def begin(
+        self, key: Hashable, wait: float = IN_FLIGHT_WAIT
+    ) -> Tuple[Optional[ActionResult], Optional[_InFlight]]:
+        """
+        Return ``(result, None)`` if ``key`` is cached, or ``(None, marker)``
+        after claiming ``key`` for the caller, who must then pass ``marker`` to
+        ``finish`` (or ``abandon``). Blocks the calling thread while another
+        thread runs the same action.
+        """
+        while True:
+            with self._lock:
+                result, claimed, pending = self._claim(key)
+            if pending is None:
+                return result, claimed
+            # Another request is running this action; wait for its result
+            if not pending.event.wait(wait):
+                claimed = self._take_over(key, pending)
+                if claimed is not None:
+                    return None, claimed
+
+    async def begin_async(
+        self, key: Hashable, wait: float = IN_FLIGHT_WAIT
+    ) -> Tuple[Optional[ActionResult], Optional[_InFlight]]:
+        """Like ``begin``, but waits for an in-flight run without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                result, claimed, pending = self._claim(key)
+                if pending is not None:
+                    waiter = loop.create_future()
+                    pending.waiters.append((loop, waiter))
+            if pending is None:
+                return result, claimed
+            try:
+                await asyncio.wait_for(waiter, wait)
+            except asyncio.TimeoutError:
+                claimed = self._take_over(key, pending)
+                if claimed is not None:
+                    return None, claimed
+
+    def finish(
+        self,
+        key: Hashable,
+        marker: _InFlight,
+        events: List[Dict[Text, Any]],
+        messages: List[Dict[Text, Any]],
+    ) -> None:
+        result = ActionResult(copy.deepcopy(events), copy.deepcopy(messages), self._clock())
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._release(key, marker)
+
+    def abandon(self, key: Hashable, marker: _InFlight) -> None:
+        """Release ``key`` without caching, e.g. when the action raised"""
+        with self._lock:
+            self._release(key, marker)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _claim(
+        self, key: Hashable
+    ) -> Tuple[Optional[ActionResult], Optional[_InFlight], Optional[_InFlight]]:
+        # Caller must hold the lock. Returns (cached result, marker the caller
+        # now owns, marker of another run to wait for); exactly one is set.
+        result = self._get(key)
+        if result is not None:
+            self.hits += 1
+            return result, None, None
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            return None, None, pending
+        claimed = self._in_flight[key] = _InFlight()
+        self.misses += 1
+        return None, claimed, None
+
+    def _take_over(self, key: Hashable, pending: _InFlight) -> Optional[_InFlight]:
+        # Give up on a stuck run and compute the result ourselves
+        with self._lock:
+            if self._in_flight.get(key) is not pending:
+                return None
+            claimed = self._in_flight[key] = _InFlight()
+            self.misses += 1
+            return claimed
+
+    def _get(self, key: Hashable) -> Optional[ActionResult]:
+        # Caller must hold the lock
+        result = self._entries.get(key)
+        if result is None:
+            return None
+        if self._clock() - result.stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _release(self, key: Hashable, marker: _InFlight) -> None:
+        # Caller must hold the lock. Only drop the marker if it is still ours;
+        # a waiter may have taken the key over since
+        if self._in_flight.get(key) is marker:
+            del self._in_flight[key]
+        marker.set()
+
+
+_cache = ActionResultCache()
+
+
+def latest_event_id(tracker: Tracker) -> Tuple[int, Any]:
+    """
+    Identify the tracker state an action was called with. Rasa events carry no
+    ID, so use the event count and the timestamp of the latest event; a retried
+    call sends the same tracker and therefore the same value.
+    """
+    if not tracker.events:
+        return 0, None
+    return len(tracker.events), tracker.events[-1].get("timestamp")
+
+
+def idempotent(run: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Decorator for ``Action.run`` that caches results by (sender_id, action name,
+    latest event ID), so a retried webhook call replays the events and messages
+    of the first call without running the action again. Works with both
+    ``def run`` and ``async def run``.
+    """
+
+    if inspect.iscoroutinefunction(run):
+
+        @functools.wraps(run)
+        async def async_wrapper(
+            self: Any,
+            dispatcher: CollectingDispatcher,
+            tracker: Tracker,
+            domain: DomainDict,
+        ) -> List[Dict[Text, Any]]:
+            key = _cache_key(self, tracker)
+            cached, marker = await _cache.begin_async(key)
+            if cached is not None:
+                return _replay(cached, dispatcher)
+
+            # Run the action in its own task so that it still finishes and fills
+            # the cache when this request is cancelled, which is what happens
+            # when the Rasa server times out and sends the retry
+            task = asyncio.ensure_future(
+                _run_and_cache(run, self, dispatcher, tracker, domain, key, marker)
+            )
+            task.add_done_callback(_consume_exception)
+            return await asyncio.shield(task)
+
+        return async_wrapper
+
+    @functools.wraps(run)
+    def wrapper(
+        self: Any,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: DomainDict,
+    ) -> List[Dict[Text, Any]]:
+        key = _cache_key(self, tracker)
+        cached, marker = _cache.begin(key)
+        if cached is not None:
+            return _replay(cached, dispatcher)
+
+        first_message = len(dispatcher.messages)
+        try:
+            events = run(self, dispatcher, tracker, domain)
+        except BaseException:
+            _cache.abandon(key, marker)
+            raise
+
+        _cache.finish(key, marker, events, dispatcher.messages[first_message:])
+        return events
+
+    return wrapper
+
+
+async def _run_and_cache(
+    run: Callable[..., Any],
+    action: Any,
+    dispatcher: CollectingDispatcher,
+    tracker: Tracker,
+    domain: DomainDict,
+    key: Hashable,
+    marker: _InFlight,
+) -> List[Dict[Text, Any]]:
+    first_message = len(dispatcher.messages)
+    try:
+        events = await run(action, dispatcher, tracker, domain)
+    except BaseException:
+        _cache.abandon(key, marker)
+        raise
+
+    _cache.finish(key, marker, events, dispatcher.messages[first_message:])
+    return events
+
+
+def _consume_exception(task: "asyncio.Future[Any]") -> None:
+    # The request that started the task may have been cancelled and will never
+    # read its outcome; retrieve it so asyncio does not log it as unhandled
+    if not task.cancelled():
+        task.exception()
+
+
+def _cache_key(action: Any, tracker: Tracker) -> Hashable:
+    return tracker.sender_id, action.name(), latest_event_id(tracker)
+
+
+def _replay(cached: ActionResult, dispatcher: CollectingDispatcher) -> List[Dict[Text, Any]]:
+    dispatcher.messages.extend(copy.deepcopy(cached.messages))
+    return copy.deepcopy(cached.events)
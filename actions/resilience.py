@@ -0,0 +1,442 @@
+"""
+Resilience layer shared by the custom actions: turn deadlines, per-backend
+timeouts, circuit breakers and last-known-good caches for degraded responses
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Text, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Optional: export breaker metrics to Prometheus (requires prometheus-client)
+try:
+    from prometheus_client import Counter, Gauge, start_http_server
+except ImportError:  # pragma: no cover - optional dependency
+    Counter = Gauge = start_http_server = None
+
+
+# Time budget for all backend work in one turn. Keep it well below the
+# action endpoint timeout configured on the Rasa server.
+DEFAULT_TURN_BUDGET = float(os.environ.get("ACTION_TURN_BUDGET_SECONDS", "5.0"))
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+_STATE_VALUES = {STATE_CLOSED: 0, STATE_HALF_OPEN: 1, STATE_OPEN: 2}
+
+# Worker threads per backend. Each backend has its own pool (a bulkhead), so
+# calls left running by a hung dependency cannot starve the other backends.
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("ACTION_BACKEND_WORKERS", "4"))
+
+if Gauge is not None:
+    _STATE_GAUGE = Gauge(
+        "action_backend_circuit_state",
+        "Circuit breaker state per backend (0=closed, 1=half_open, 2=open)",
+        ["backend"],
+    )
+    _CALLS_COUNTER = Counter(
+        "action_backend_calls",
+        "Backend calls made by actions, by outcome",
+        ["backend", "outcome"],
+    )
+else:
+    _STATE_GAUGE = _CALLS_COUNTER = None
+
+
+class BackendUnavailable(Exception):
+    """Raised when a backend call is rejected, times out or fails"""
+
+    def __init__(self, backend: Text, reason: Text, cached: Optional["CachedResult"] = None):
+        super().__init__(f"{backend} unavailable: {reason}")
+        self.backend = backend
+        self.reason = reason
+        # Last known good result for the requested key, if any
+        self.cached = cached
+
+
+class Deadline:
+    """Time budget for one conversation turn, shared by every backend call in it"""
+
+    def __init__(self, budget: float = DEFAULT_TURN_BUDGET, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self.expires_at = clock() + budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - self._clock())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+
+class CachedResult:
+    """A successful backend result together with the time it was fetched"""
+
+    def __init__(self, value: Any, as_of: datetime, stored_at: float):
+        self.value = value
+        self.as_of = as_of
+        self.stored_at = stored_at
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker over a sliding window of recent calls.
+
+    Opens when the error rate or the slow-call rate over the window reaches its
+    threshold, rejects calls while open, and after ``reset_timeout`` lets a
+    single trial call through (half open) to decide whether to close again.
+    """
+
+    def __init__(
+        self,
+        name: Text,
+        window_size: int = 20,
+        minimum_calls: int = 5,
+        failure_rate_threshold: float = 0.5,
+        slow_call_duration: float = 1.0,
+        slow_call_rate_threshold: float = 0.5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.minimum_calls = minimum_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Each entry is (failed, slow)
+        self._window: Deque[Tuple[bool, bool]] = deque(maxlen=window_size)
+        self._state = STATE_CLOSED
+        # Bumped on every state change; results of calls admitted under an
+        # earlier generation are stale and ignored
+        self._generation = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.times_opened = 0
+        self.rejected_calls = 0
+        self._publish_state()
+
+    @property
+    def state(self) -> Text:
+        with self._lock:
+            return self._current_state()
+
+    def allow_request(self) -> Optional[int]:
+        """
+        Return a token if a call may proceed (reserving the trial slot when half
+        open), or None if it is rejected. Pass the token back to ``record``.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == STATE_CLOSED:
+                return self._generation
+            if state == STATE_HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return self._generation
+            self.rejected_calls += 1
+            return None
+
+    def record(self, token: int, failed: bool, duration: float) -> None:
+        """Record the outcome of a call admitted with ``token``"""
+        slow = duration >= self.slow_call_duration
+        with self._lock:
+            state = self._current_state()
+            if token != self._generation:
+                # Admitted before the last state change, e.g. a late result from
+                # while the breaker was closed arriving during a half-open trial
+                return
+            if state == STATE_HALF_OPEN:
+                self._trial_in_flight = False
+                if failed or slow:
+                    self._open()
+                else:
+                    self._transition(STATE_CLOSED)
+                    self._window.clear()
+                return
+
+            self._window.append((failed, slow))
+            if len(self._window) < self.minimum_calls:
+                return
+            failure_rate, slow_rate = self._rates()
+            if failure_rate >= self.failure_rate_threshold or slow_rate >= self.slow_call_rate_threshold:
+                self._open()
+
+    def release(self, token: int) -> None:
+        """
+        Give back a call admitted with ``token`` that ended without an outcome,
+        e.g. because it was cancelled, freeing the trial slot if it held it
+        """
+        with self._lock:
+            if token == self._generation and self._current_state() == STATE_HALF_OPEN:
+                self._trial_in_flight = False
+
+    def metrics(self) -> Dict[Text, Any]:
+        with self._lock:
+            failure_rate, slow_rate = self._rates()
+            return {
+                "state": self._current_state(),
+                "window_calls": len(self._window),
+                "failure_rate": failure_rate,
+                "slow_call_rate": slow_rate,
+                "times_opened": self.times_opened,
+                "rejected_calls": self.rejected_calls,
+            }
+
+    def _rates(self) -> Tuple[float, float]:
+        if not self._window:
+            return 0.0, 0.0
+        calls = len(self._window)
+        failures = sum(1 for failed, _ in self._window if failed)
+        slow = sum(1 for _, is_slow in self._window if is_slow)
+        return failures / calls, slow / calls
+
+    def _current_state(self) -> Text:
+        # Caller must hold the lock
+        if self._state == STATE_OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._trial_in_flight = False
+            self._transition(STATE_HALF_OPEN)
+        return self._state
+
+    def _open(self) -> None:
+        self._opened_at = self._clock()
+        self.times_opened += 1
+        self._transition(STATE_OPEN)
+        self._window.clear()
+
+    def _transition(self, state: Text) -> None:
+        # Caller must hold the lock
+        if state == self._state:
+            return
+        failure_rate, slow_rate = self._rates()
+        logger.warning(
+            "Circuit breaker '%s' changed from %s to %s "
+            "(failure rate %.0f%%, slow-call rate %.0f%% over %d calls, %d calls rejected)",
+            self.name, self._state, state,
+            failure_rate * 100, slow_rate * 100, len(self._window), self.rejected_calls,
+        )
+        self._generation += 1
+        self._state = state
+
+    def _publish_state(self) -> None:
+        # Evaluated on every scrape, so an open breaker whose reset timeout has
+        # passed reports half open even if no request has touched it since
+        if _STATE_GAUGE is not None:
+            _STATE_GAUGE.labels(backend=self.name).set_function(lambda: _STATE_VALUES[self.state])
+
+
+class ResilientBackend:
+    """
+    Wraps calls to one backend service with a timeout, a circuit breaker, a
+    bulkhead of worker threads and a bounded cache of last known good results
+    used for degraded responses.
+    """
+
+    def __init__(
+        self,
+        name: Text,
+        timeout: float = 2.0,
+        breaker: Optional[CircuitBreaker] = None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        cache_size: int = 1024,
+        cache_max_age: float = 900.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker(name, clock=clock)
+        self.max_concurrency = max_concurrency
+        self.cache_size = cache_size
+        self.cache_max_age = cache_max_age
+        self._clock = clock
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix=f"action-backend-{name}",
+        )
+        # Calls holding a worker, including ones abandoned after a timeout
+        # that are still running
+        self._active = 0
+        self._active_lock = threading.Lock()
+        self._cache: "OrderedDict[Hashable, CachedResult]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        _registry[name] = self
+
+    @property
+    def active_calls(self) -> int:
+        with self._active_lock:
+            return self._active
+
+    async def call(
+        self,
+        func: Callable[..., Any],
+        *args: Any,
+        deadline: Optional[Deadline] = None,
+        cache_key: Optional[Hashable] = None,
+        **kwargs: Any,
+    ) -> Any:
+        """
+        Call ``func`` on this backend's worker threads within the smaller of its
+        timeout and the time left on ``deadline``, without blocking the event
+        loop. Raises BackendUnavailable, carrying the cached result for
+        ``cache_key`` if one exists, when the call cannot complete.
+        """
+        timeout = self.timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline.remaining())
+        if timeout <= 0:
+            self._count("deadline_exceeded")
+            raise BackendUnavailable(self.name, "turn deadline exceeded", self.cached(cache_key))
+
+        # Reject rather than queue when every worker is busy, so a call never
+        # spends its timeout waiting for a thread
+        if not self._acquire_worker():
+            self._count("rejected")
+            raise BackendUnavailable(self.name, "all workers busy", self.cached(cache_key))
+
+        token = self.breaker.allow_request()
+        if token is None:
+            self._release_worker()
+            self._count("rejected")
+            raise BackendUnavailable(self.name, "circuit open", self.cached(cache_key))
+
+        started = self._clock()
+        future = self._executor.submit(func, *args, **kwargs)
+        future.add_done_callback(self._release_worker)
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            # The worker stays busy until func returns; the bulkhead limits how
+            # many such calls one backend can pile up
+            self.breaker.record(token, failed=True, duration=self._clock() - started)
+            self._count("timeout")
+            raise BackendUnavailable(self.name, f"timed out after {timeout:.2f}s", self.cached(cache_key))
+        except Exception as e:
+            self.breaker.record(token, failed=True, duration=self._clock() - started)
+            self._count("error")
+            raise BackendUnavailable(self.name, f"error: {e}", self.cached(cache_key)) from e
+        except BaseException:
+            # Cancelled, e.g. the Rasa server dropped the connection; this says
+            # nothing about the backend, but a half-open trial slot must not leak
+            self.breaker.release(token)
+            self._count("cancelled")
+            raise
+
+        self.breaker.record(token, failed=False, duration=self._clock() - started)
+        self._count("success")
+        if cache_key is not None:
+            self._store(cache_key, result)
+        return result
+
+    def cached(self, cache_key: Optional[Hashable]) -> Optional[CachedResult]:
+        """Return the last known good result for ``cache_key`` if it is not too old"""
+        if cache_key is None:
+            return None
+        with self._cache_lock:
+            entry = self._cache.get(cache_key)
+            if entry is None:
+                return None
+            if self._clock() - entry.stored_at > self.cache_max_age:
+                del self._cache[cache_key]
+                return None
+            return entry
+
+    def metrics(self) -> Dict[Text, Any]:
+        metrics = self.breaker.metrics()
+        metrics["active_calls"] = self.active_calls
+        return metrics
+
+    def _acquire_worker(self) -> bool:
+        with self._active_lock:
+            if self._active >= self.max_concurrency:
+                return False
+            self._active += 1
+            return True
+
+    def _release_worker(self, future: Optional[Future] = None) -> None:
+        with self._active_lock:
+            self._active -= 1
+
+    def _store(self, cache_key: Hashable, value: Any) -> None:
+        with self._cache_lock:
+            self._cache[cache_key] = CachedResult(value, datetime.now(), self._clock())
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _count(self, outcome: Text) -> None:
+        if _CALLS_COUNTER is not None:
+            _CALLS_COUNTER.labels(backend=self.name, outcome=outcome).inc()
+
+
+class FaultInjector:
+    """
+    Local stand-in for a backend that adds latency and raises errors on demand.
+    Use it to exercise timeouts and breakers without a real dependency.
+    """
+
+    def __init__(
+        self,
+        func: Callable[..., Any],
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.func = func
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._sleep = sleep
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        self.calls += 1
+        if self.latency:
+            self._sleep(self.latency)
+        if self._random.random() < self.error_rate:
+            raise ConnectionError("injected fault")
+        return self.func(*args, **kwargs)
+
+
+_registry: Dict[Text, ResilientBackend] = {}
+
+
+def metrics_snapshot() -> Dict[Text, Dict[Text, Any]]:
+    """Return breaker and bulkhead metrics for every registered backend"""
+    return {name: backend.metrics() for name, backend in _registry.items()}
+
+
+_metrics_server_started = False
+
+
+def start_metrics_server() -> bool:
+    """
+    Serve Prometheus metrics if ACTION_METRICS_PORT is set and prometheus-client
+    is installed. Safe to call more than once; a port already in use is logged
+    rather than raised so the action server still starts.
+    """
+    global _metrics_server_started
+    port = os.environ.get("ACTION_METRICS_PORT")
+    if _metrics_server_started or not port or start_http_server is None:
+        return False
+    try:
+        start_http_server(int(port))
+    except OSError as e:
+        logger.warning("Could not start action metrics server on port %s: %s", port, e)
+        return False
+    _metrics_server_started = True
+    return True
+
+
+def format_as_of(cached: CachedResult) -> Text:
+    return cached.as_of.strftime("%Y-%m-%d %H:%M")
+
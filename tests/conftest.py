@@ -0,0 +1,19 @@
+import pytest
+
+
+class FakeClock:
+    """Monotonic clock that only moves when told to (or when a stub sleeps on it)"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
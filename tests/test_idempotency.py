@@ -0,0 +1,262 @@
+"""
+Tests for idempotent action execution
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+from rasa_sdk import Action, Tracker
+from rasa_sdk.events import SlotSet
+from rasa_sdk.executor import CollectingDispatcher
+
+from actions import idempotency
+from actions.actions import ActionVerifyIdentity
+from actions.idempotency import ActionResultCache, idempotent
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    cache = ActionResultCache()
+    monkeypatch.setattr(idempotency, "_cache", cache)
+    return cache
+
+
+def make_tracker(sender_id="user", slots=None, text="hello", events=None):
+    if events is None:
+        events = [{"event": "user", "timestamp": 1.0, "text": text}]
+    return Tracker(
+        sender_id,
+        slots or {},
+        {"text": text, "entities": [], "intent": {}},
+        events,
+        False,
+        None,
+        {},
+        "action_listen",
+    )
+
+
+class CountingAction(Action):
+    """Sync action that counts how often it really runs"""
+
+    def __init__(self, delay=0.0, fail_first=False):
+        self.runs = 0
+        self.delay = delay
+        self.fail_first = fail_first
+
+    def name(self):
+        return "action_counting"
+
+    @idempotent
+    def run(self, dispatcher, tracker, domain):
+        self.runs += 1
+        if self.fail_first and self.runs == 1:
+            raise ConnectionError("backend down")
+        time.sleep(self.delay)
+        dispatcher.utter_message(text=f"run {self.runs}")
+        return [SlotSet("runs", float(self.runs))]
+
+
+class AsyncCountingAction(CountingAction):
+    """Async action that counts how often it really runs"""
+
+    def name(self):
+        return "action_async_counting"
+
+    @idempotent
+    async def run(self, dispatcher, tracker, domain):
+        self.runs += 1
+        await asyncio.sleep(self.delay)
+        dispatcher.utter_message(text=f"run {self.runs}")
+        return [SlotSet("runs", float(self.runs))]
+
+
+def test_retry_replays_verification_without_rerunning():
+    action = ActionVerifyIdentity()
+    tracker = make_tracker(slots={"verification_attempts": 1.0}, text="not a number")
+
+    first, second = CollectingDispatcher(), CollectingDispatcher()
+    first_events = asyncio.run(action.run(first, tracker, {}))
+    second_events = asyncio.run(action.run(second, tracker, {}))
+
+    assert first_events == [SlotSet("verification_attempts", 2.0)]
+    assert second_events == first_events
+    assert second.messages == first.messages
+    assert idempotency._cache.hits == 1
+
+
+def test_new_event_runs_action_again():
+    action = CountingAction()
+    action.run(CollectingDispatcher(), make_tracker(), {})
+    later = make_tracker(events=[{"event": "user", "timestamp": 1.0}, {"event": "user", "timestamp": 2.0}])
+
+    action.run(CollectingDispatcher(), later, {})
+
+    assert action.runs == 2
+
+
+def test_sync_retry_replays_events_and_messages():
+    action = CountingAction()
+    tracker = make_tracker()
+    action.run(CollectingDispatcher(), tracker, {})
+
+    dispatcher = CollectingDispatcher()
+    events = action.run(dispatcher, tracker, {})
+
+    assert action.runs == 1
+    assert events == [SlotSet("runs", 1.0)]
+    assert [m["text"] for m in dispatcher.messages] == ["run 1"]
+
+
+def test_async_run_caches_events_not_coroutine():
+    action = AsyncCountingAction()
+    tracker = make_tracker()
+
+    first = asyncio.run(action.run(CollectingDispatcher(), tracker, {}))
+    second = asyncio.run(action.run(CollectingDispatcher(), tracker, {}))
+
+    assert first == second == [SlotSet("runs", 1.0)]
+    assert action.runs == 1
+
+
+def test_entries_expire_after_ttl(monkeypatch, clock):
+    monkeypatch.setattr(idempotency, "_cache", ActionResultCache(ttl=60.0, clock=clock))
+    action = CountingAction()
+    tracker = make_tracker()
+    action.run(CollectingDispatcher(), tracker, {})
+
+    clock.sleep(59.0)
+    action.run(CollectingDispatcher(), tracker, {})
+    assert action.runs == 1
+
+    clock.sleep(2.0)
+    action.run(CollectingDispatcher(), tracker, {})
+    assert action.runs == 2
+
+
+def test_least_recently_used_entry_is_evicted(monkeypatch):
+    monkeypatch.setattr(idempotency, "_cache", ActionResultCache(max_entries=2))
+    action = CountingAction()
+    trackers = [make_tracker(sender_id=f"user-{i}") for i in range(3)]
+
+    action.run(CollectingDispatcher(), trackers[0], {})
+    action.run(CollectingDispatcher(), trackers[1], {})
+    action.run(CollectingDispatcher(), trackers[0], {})
+    action.run(CollectingDispatcher(), trackers[2], {})
+    assert len(idempotency._cache) == 2
+    assert action.runs == 3
+
+    action.run(CollectingDispatcher(), trackers[0], {})
+    assert action.runs == 3
+    action.run(CollectingDispatcher(), trackers[1], {})
+    assert action.runs == 4
+
+
+def test_failed_run_is_not_cached():
+    action = CountingAction(fail_first=True)
+    tracker = make_tracker()
+
+    with pytest.raises(ConnectionError):
+        action.run(CollectingDispatcher(), tracker, {})
+    dispatcher = CollectingDispatcher()
+    action.run(dispatcher, tracker, {})
+
+    assert action.runs == 2
+    assert [m["text"] for m in dispatcher.messages] == ["run 2"]
+
+
+def test_concurrent_threads_run_action_once():
+    action = CountingAction(delay=0.2)
+    tracker = make_tracker()
+    dispatchers = [CollectingDispatcher(), CollectingDispatcher()]
+    results = [None, None]
+
+    def retry(i):
+        results[i] = action.run(dispatchers[i], tracker, {})
+
+    threads = [threading.Thread(target=retry, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert action.runs == 1
+    assert results[0] == results[1] == [SlotSet("runs", 1.0)]
+    assert dispatchers[0].messages == dispatchers[1].messages
+
+
+def test_concurrent_coroutines_run_action_once():
+    action = AsyncCountingAction(delay=0.2)
+    tracker = make_tracker()
+
+    async def retry_while_running():
+        return await asyncio.gather(
+            action.run(CollectingDispatcher(), tracker, {}),
+            action.run(CollectingDispatcher(), tracker, {}),
+        )
+
+    started = time.monotonic()
+    first, second = asyncio.run(retry_while_running())
+
+    assert action.runs == 1
+    assert first == second
+    # The retry waited on the event loop instead of blocking it
+    assert time.monotonic() - started < 1.0
+
+
+def test_cancelled_request_still_caches_result_for_retry():
+    class SlowAction(Action):
+        def __init__(self):
+            self.runs = 0
+            self.started = asyncio.Event()
+            self.release = asyncio.Event()
+
+        def name(self):
+            return "action_slow"
+
+        @idempotent
+        async def run(self, dispatcher, tracker, domain):
+            self.runs += 1
+            self.started.set()
+            await self.release.wait()
+            dispatcher.utter_message(text="done")
+            return [SlotSet("runs", float(self.runs))]
+
+    tracker = make_tracker()
+
+    async def timeout_and_retry():
+        action = SlowAction()
+        first = asyncio.ensure_future(action.run(CollectingDispatcher(), tracker, {}))
+        await action.started.wait()
+        retry_dispatcher = CollectingDispatcher()
+        retry = asyncio.ensure_future(action.run(retry_dispatcher, tracker, {}))
+        await asyncio.sleep(0)
+        # The Rasa server gave up on the first call
+        first.cancel()
+        action.release.set()
+        return action, await retry, retry_dispatcher
+
+    action, events, dispatcher = asyncio.run(timeout_and_retry())
+
+    assert action.runs == 1
+    assert events == [SlotSet("runs", 1.0)]
+    assert [m["text"] for m in dispatcher.messages] == ["done"]
+    assert idempotency._cache.hits == 1
+
+
+def test_stale_owner_does_not_release_new_owners_claim(fresh_cache):
+    key = ("user", "action_counting", (1, 1.0))
+    _, original = fresh_cache.begin(key)
+    _, taker = fresh_cache.begin(key, wait=0.01)
+    assert taker is not None and taker is not original
+
+    fresh_cache.abandon(key, original)
+    assert fresh_cache._in_flight[key] is taker
+
+    fresh_cache.finish(key, taker, [SlotSet("runs", 1.0)], [])
+    cached, marker = fresh_cache.begin(key)
+    assert marker is None
+    assert cached.events == [SlotSet("runs", 1.0)]
+    assert key not in fresh_cache._in_flight
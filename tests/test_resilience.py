@@ -0,0 +1,301 @@
+"""
+Tests for the resilience layer, driven by FaultInjector stubs and injected clocks
+"""
+
+import asyncio
+import itertools
+import threading
+
+import pytest
+
+from actions.resilience import (
+    STATE_CLOSED,
+    STATE_HALF_OPEN,
+    STATE_OPEN,
+    BackendUnavailable,
+    CircuitBreaker,
+    Deadline,
+    FaultInjector,
+    ResilientBackend,
+    format_as_of,
+    metrics_snapshot,
+)
+
+_names = itertools.count()
+
+
+def make_backend(clock, timeout=1.0, **breaker_kwargs):
+    name = f"test-backend-{next(_names)}"
+    breaker_kwargs.setdefault("minimum_calls", 4)
+    breaker_kwargs.setdefault("reset_timeout", 30.0)
+    breaker = CircuitBreaker(name, clock=clock, **breaker_kwargs)
+    return ResilientBackend(name, timeout=timeout, breaker=breaker, clock=clock)
+
+
+def call(backend, func, *args, **kwargs):
+    return asyncio.run(backend.call(func, *args, **kwargs))
+
+
+def blocking_stub():
+    """FaultInjector that blocks until released; also returns its started/release events"""
+    started, release = threading.Event(), threading.Event()
+
+    def hang():
+        started.set()
+        release.wait(5)
+        return "ok"
+
+    return FaultInjector(hang), started, release
+
+
+def fail_until_open(backend):
+    failing = FaultInjector(lambda: "ok", error_rate=1.0, seed=1)
+    for _ in range(backend.breaker.minimum_calls):
+        with pytest.raises(BackendUnavailable):
+            call(backend, failing)
+    assert backend.breaker.state == STATE_OPEN
+
+
+def test_breaker_opens_on_error_rate(clock):
+    backend = make_backend(clock)
+    failing = FaultInjector(lambda: "ok", error_rate=1.0, seed=1)
+
+    for _ in range(3):
+        with pytest.raises(BackendUnavailable, match="injected fault"):
+            call(backend, failing)
+        assert backend.breaker.state == STATE_CLOSED
+
+    with pytest.raises(BackendUnavailable):
+        call(backend, failing)
+    assert backend.breaker.state == STATE_OPEN
+    assert backend.breaker.times_opened == 1
+
+
+def test_breaker_stays_closed_below_error_rate(clock):
+    backend = make_backend(clock)
+    healthy = FaultInjector(lambda: "ok")
+    failing = FaultInjector(lambda: "ok", error_rate=1.0, seed=1)
+
+    for _ in range(3):
+        assert call(backend, healthy) == "ok"
+    with pytest.raises(BackendUnavailable):
+        call(backend, failing)
+
+    assert backend.breaker.state == STATE_CLOSED
+
+
+def test_breaker_opens_on_slow_call_rate(clock):
+    backend = make_backend(clock, slow_call_duration=1.0)
+    slow = FaultInjector(lambda: "ok", latency=2.0, sleep=clock.sleep)
+
+    for _ in range(4):
+        assert call(backend, slow) == "ok"
+
+    assert slow.calls == 4
+    assert backend.breaker.state == STATE_OPEN
+
+
+def test_open_breaker_rejects_without_calling_backend(clock):
+    backend = make_backend(clock)
+    fail_until_open(backend)
+    healthy = FaultInjector(lambda: "ok")
+
+    with pytest.raises(BackendUnavailable, match="circuit open"):
+        call(backend, healthy)
+
+    assert healthy.calls == 0
+    assert backend.breaker.rejected_calls == 1
+
+
+def test_half_open_trial_success_closes_breaker(clock):
+    backend = make_backend(clock)
+    fail_until_open(backend)
+
+    clock.sleep(30.0)
+    assert backend.breaker.state == STATE_HALF_OPEN
+    assert call(backend, FaultInjector(lambda: "ok")) == "ok"
+
+    assert backend.breaker.state == STATE_CLOSED
+
+
+def test_half_open_trial_failure_reopens_breaker(clock):
+    backend = make_backend(clock)
+    fail_until_open(backend)
+
+    clock.sleep(30.0)
+    with pytest.raises(BackendUnavailable, match="injected fault"):
+        call(backend, FaultInjector(lambda: "ok", error_rate=1.0, seed=1))
+
+    assert backend.breaker.state == STATE_OPEN
+    assert backend.breaker.times_opened == 2
+
+
+def test_half_open_allows_a_single_trial(clock):
+    breaker = CircuitBreaker("single-trial", minimum_calls=1, reset_timeout=5.0, clock=clock)
+    breaker.record(breaker.allow_request(), failed=True, duration=0.0)
+
+    clock.sleep(5.0)
+    assert breaker.allow_request() is not None
+    assert breaker.allow_request() is None
+    assert breaker.rejected_calls == 1
+
+
+def test_late_result_from_closed_state_does_not_decide_trial(clock):
+    breaker = CircuitBreaker("stale-result", minimum_calls=1, reset_timeout=5.0, clock=clock)
+    late = breaker.allow_request()
+    breaker.record(breaker.allow_request(), failed=True, duration=0.0)
+    assert breaker.state == STATE_OPEN
+
+    clock.sleep(5.0)
+    trial = breaker.allow_request()
+    breaker.record(late, failed=False, duration=0.0)
+    assert breaker.state == STATE_HALF_OPEN
+
+    breaker.record(trial, failed=False, duration=0.0)
+    assert breaker.state == STATE_CLOSED
+
+
+def test_late_failure_while_open_is_ignored(clock):
+    breaker = CircuitBreaker("late-failure", minimum_calls=1, clock=clock)
+    late = breaker.allow_request()
+    breaker.record(breaker.allow_request(), failed=True, duration=0.0)
+
+    breaker.record(late, failed=True, duration=0.0)
+
+    assert breaker.times_opened == 1
+
+
+def test_cancelled_half_open_trial_frees_trial_slot(clock):
+    backend = make_backend(clock)
+    fail_until_open(backend)
+    clock.sleep(30.0)
+    hung, started, release = blocking_stub()
+
+    async def cancel_trial():
+        trial = asyncio.ensure_future(backend.call(hung))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+    asyncio.run(cancel_trial())
+    release.set()
+
+    assert backend.breaker.state == STATE_HALF_OPEN
+    assert backend.breaker.allow_request() is not None
+
+
+def test_exhausted_deadline_skips_backend(clock):
+    backend = make_backend(clock)
+    healthy = FaultInjector(lambda: "ok")
+    deadline = Deadline(0.5, clock=clock)
+
+    clock.sleep(1.0)
+    assert deadline.expired()
+    with pytest.raises(BackendUnavailable, match="turn deadline exceeded"):
+        call(backend, healthy, deadline=deadline)
+
+    assert healthy.calls == 0
+
+
+def test_deadline_shortens_backend_timeout(clock):
+    backend = ResilientBackend(f"test-backend-{next(_names)}", timeout=5.0)
+    hung, _, release = blocking_stub()
+
+    try:
+        with pytest.raises(BackendUnavailable, match="timed out after 0.05s"):
+            call(backend, hung, deadline=Deadline(0.05, clock=clock))
+    finally:
+        release.set()
+
+
+def test_degraded_reply_uses_cached_result_as_of(clock):
+    backend = make_backend(clock)
+    healthy = FaultInjector(lambda: "$5,432.10")
+    assert call(backend, healthy, cache_key="balance") == "$5,432.10"
+    fail_until_open(backend)
+
+    with pytest.raises(BackendUnavailable) as excinfo:
+        call(backend, healthy, cache_key="balance")
+
+    cached = excinfo.value.cached
+    assert cached.value == "$5,432.10"
+    assert format_as_of(cached) == cached.as_of.strftime("%Y-%m-%d %H:%M")
+    assert backend.cached("other") is None
+
+
+def test_cached_result_expires(clock):
+    backend = make_backend(clock)
+    call(backend, FaultInjector(lambda: "ok"), cache_key="key")
+
+    clock.sleep(backend.cache_max_age + 1)
+
+    assert backend.cached("key") is None
+
+
+def test_slow_backend_does_not_starve_other_backends():
+    slow_backend = ResilientBackend(f"test-backend-{next(_names)}", timeout=0.05, max_concurrency=1)
+    other_backend = ResilientBackend(f"test-backend-{next(_names)}", timeout=5.0)
+    hung, _, release = blocking_stub()
+
+    try:
+        with pytest.raises(BackendUnavailable, match="timed out"):
+            call(slow_backend, hung)
+        # The timed-out call still holds the only worker; further calls are
+        # rejected at once rather than queued behind it
+        with pytest.raises(BackendUnavailable, match="all workers busy"):
+            call(slow_backend, hung)
+        assert hung.calls == 1
+        assert slow_backend.active_calls == 1
+
+        assert call(other_backend, FaultInjector(lambda: "ok")) == "ok"
+    finally:
+        release.set()
+
+    # Joining the worker also waits for its done callback to free the slot
+    slow_backend._executor.shutdown(wait=True)
+    assert slow_backend.active_calls == 0
+
+
+def test_metrics_snapshot_reports_each_backend(clock):
+    backend = make_backend(clock)
+    fail_until_open(backend)
+    with pytest.raises(BackendUnavailable):
+        call(backend, FaultInjector(lambda: "ok"))
+
+    metrics = metrics_snapshot()[backend.name]
+
+    assert metrics == {
+        "state": STATE_OPEN,
+        "window_calls": 0,
+        "failure_rate": 0.0,
+        "slow_call_rate": 0.0,
+        "times_opened": 1,
+        "rejected_calls": 1,
+        "active_calls": 0,
+    }
+
+
+def test_transition_is_logged_with_rates(caplog, clock):
+    backend = make_backend(clock)
+
+    with caplog.at_level("WARNING", logger="actions.resilience"):
+        fail_until_open(backend)
+
+    assert f"Circuit breaker '{backend.name}' changed from closed to open" in caplog.text
+    assert "failure rate 100%" in caplog.text
+
+
+def test_state_gauge_reports_half_open_without_traffic(clock):
+    prometheus_client = pytest.importorskip("prometheus_client")
+    backend = make_backend(clock)
+    fail_until_open(backend)
+
+    def scrape():
+        return prometheus_client.REGISTRY.get_sample_value(
+            "action_backend_circuit_state", {"backend": backend.name}
+        )
+
+    assert scrape() == 2
+    clock.sleep(30.0)
+    assert scrape() == 1